@@ -0,0 +1,113 @@
+import argparse
+import importlib.util
+import itertools
+import logging
+import os
+import random
+import sys
+
+# rally-optimize.py is a script with a hyphenated name, load it as a module
+spec = importlib.util.spec_from_file_location('rally_optimize', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rally-optimize.py'))
+rally = importlib.util.module_from_spec(spec)
+sys.modules['rally_optimize'] = rally
+spec.loader.exec_module(rally)
+
+def random_app(path, seed, extra):
+    app = rally.AppState()
+    app.rng = random.Random(seed)
+    app.print_rankings = False
+    app.load(path)
+
+    for i in range(extra):
+        app.deck.cards.append(rally.Card.random(minE=2, rng=app.rng))
+
+    return app
+
+def check_balance(app, decks, tolerance):
+    """Compare BalanceTable against the ComplexDeck path, return the worst difference and the failures."""
+    app.balance_decks(decks)
+    table_results = list(map(lambda d: d.resources, decks))
+
+    worst = 0
+    failures = []
+
+    for deck, expected in zip(decks, table_results):
+        # the ComplexDeck path is only taken while dumping score data
+        app.dump_score_data = True
+        deck.minimize_delta()
+        app.dump_score_data = False
+        app.score_data.clear()
+
+        diff = max(abs(deck.resources.wood - expected.wood), abs(deck.resources.stone - expected.stone))
+        worst = max(worst, diff)
+
+        if diff > tolerance:
+            failures.append((deck, diff))
+
+    return worst, failures
+
+def check_damage(app, brute_sizes, tolerance):
+    """Compare DamageSearch against Deck.get_damage and, for the largest sizes, brute force."""
+    roster = app.deck.cards
+    search = rally.DamageSearch(app.get_roster_tables())
+    failures = []
+    results = search.solve_all()
+
+    # the single best deck search must agree with the best of every size
+    indices, damage = search.solve_best()
+    best_size, (best_indices, best_damage) = max(results.items(), key=lambda r: r[1][1])
+
+    if abs(damage - best_damage) > tolerance:
+        failures.append((len(indices), "best deck has {:.6f}, best of every size {:.6f} at {} cards".format(damage, best_damage, best_size)))
+
+    for size, (indices, damage) in results.items():
+        deck = rally.Deck(app, list(map(lambda i: roster[i], indices)))
+
+        if abs(deck.get_damage() - damage) > tolerance:
+            failures.append((size, "reported {:.6f}, deck has {:.6f}".format(damage, deck.get_damage())))
+
+        if size >= len(roster) - brute_sizes:
+            best = max(map(lambda cards: rally.Deck(app, list(cards)).get_damage(), itertools.combinations(roster, size)))
+
+            if best > damage + tolerance:
+                failures.append((size, "found {:.6f}, brute force {:.6f}".format(damage, best)))
+
+    return failures
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check the table-driven searches against the reference object model.")
+    parser.add_argument('input', nargs='?', default='input.txt', help="tab-separated card list")
+    parser.add_argument('--seeds', type=int, default=4, help="random rosters to check")
+    parser.add_argument('--decks', type=int, default=24, help="decks per roster to balance both ways")
+    parser.add_argument('--brute-sizes', type=int, default=3, help="deck sizes below the roster size to brute force")
+    parser.add_argument('--tolerance', type=float, default=1e-4, help="largest accepted difference; float-level ties between equally good flip stopping points can resolve differently")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    failed = False
+
+    for seed in range(args.seeds):
+        app = random_app(args.input, seed, seed)
+        rng = random.Random(seed)
+
+        decks = []
+
+        for i in range(args.decks):
+            size = rng.randint(10, len(app.deck))
+            decks.append(rally.Deck(app, sorted(rng.sample(app.deck.cards, size), key=app.deck.cards.index)))
+
+        worst, balance_failures = check_balance(app, decks, args.tolerance)
+        damage_failures = check_damage(app, args.brute_sizes, args.tolerance)
+
+        print("Seed {}\t{} cards\tbalance worst {:.2e}\t{} balance failures\t{} damage failures".format(seed, len(app.deck), worst, len(balance_failures), len(damage_failures)))
+
+        for deck, diff in balance_failures:
+            print("  balance {}: off by {:.2e}".format(deck, diff))
+
+        for size, message in damage_failures:
+            print("  damage {}-card: {}".format(size, message))
+
+        failed = failed or bool(balance_failures) or bool(damage_failures)
+
+    sys.exit(1 if failed else 0)
@@ -6,14 +6,22 @@ import copy
 import inspect
 import random
 import json
+import argparse
+import multiprocessing
+import sys
+from multiprocessing import shared_memory
 from statistics import mean
+from statistics import pstdev
 from enum import Enum
 from functools import lru_cache
 from functools import cached_property
 
+import numpy as np
 import progressbar
 
 import profile_tools
+import telemetry
+import rally_format
 from profile_tools import profile_cumulative
 from profile_tools import profile
 from profile_tools import ChunkProfiler
@@ -142,6 +150,30 @@ class ResourceContainer:
 		else:
 			return None
 
+# Deck objectives. Each takes the total resources and the wood-stone delta of
+# a deck plus a penalty coefficient; they work on floats and numpy arrays alike.
+def quadratic_objective(total, delta, penalty):
+	return total - penalty * delta ** 2 / total
+
+def linear_objective(total, delta, penalty):
+	return total - penalty * delta
+
+def power_objective(total, delta, penalty):
+	return total - penalty * (delta / 1.36) ** 3.475
+
+OBJECTIVES = {
+	'quadratic': quadratic_objective,
+	'linear': linear_objective,
+	'power': power_objective,
+}
+
+# default sweep grids, each around the coefficient its formula was tuned with
+OBJECTIVE_PENALTIES = {
+	'quadratic': (0.25, 0.5, 0.96, 1.5, 2.0, 3.0),
+	'linear': (0.02, 0.05, 0.0842, 0.15, 0.25, 0.5),
+	'power': (0.03, 0.06, 0.11424, 0.2, 0.4, 0.8),
+}
+
 class Hand:
 	damage_cache = {}
 
@@ -159,7 +191,10 @@ class Hand:
 		return repr(self.cards)
 
 	def get_score(self):
-		if repr(self.cards) not in self.app.hand_cache:
+		hit = repr(self.cards) in self.app.hand_cache
+		telemetry.cache_lookup('hand_score', hit)
+
+		if not hit:
 			resources = ResourceContainer()
 
 			for boss in self.app.bosses:
@@ -194,8 +229,10 @@ class Hand:
 
 	def get_damage(self):
 		key = repr(self)
+		hit = key in self.damage_cache
+		telemetry.cache_lookup('hand_damage', hit)
 
-		if key not in self.damage_cache:
+		if not hit:
 			damage = 0
 
 			for boss in self.app.bosses:
@@ -282,10 +319,417 @@ class ComplexDeck():
 		data = {}
 
 		for pair in self.pairs:
-			data[repr(pair.selection)] = repr(pair.resources)
+			data[repr(pair)] = [pair.resources.wood, pair.resources.stone]
 
 		self.app.score_data[str(self.deck)] = data
 
+class RosterTables():
+	# Flat typed arrays describing a roster against every boss class. They can be
+	# published to shared memory so worker processes score decks without the
+	# Card/Boss/Deck object graph or its caches.
+	fields = (
+		('element_masks', np.uint8),
+		('element_counts', np.uint8),
+		('resource_kinds', np.uint8),
+		('resource_amounts', np.int32),
+		('spawn_chances', np.float64),
+		('damages', np.float64),
+		('resources', np.float64),
+	)
+
+	def __init__(self, arrays, cards=None, shm=None):
+		self.arrays = arrays
+		self.cards = cards
+		self.shm = shm
+
+		for name, array in arrays.items():
+			setattr(self, name, array)
+
+		if cards is not None:
+			self.indices = {id(card): i for i, card in enumerate(cards)}
+
+	def __len__(self):
+		return len(self.element_counts)
+
+	@classmethod
+	def compile(cls, app, cards):
+		cards = list(cards)
+		bosses = app.bosses
+		n = len(cards)
+
+		arrays = {
+			'element_masks': [sum(set(map(lambda e: 1 << (e.value - 1), card.elements))) for card in cards],
+			'element_counts': [len(card.elements) for card in cards],
+			'resource_kinds': [card.resource.value for card in cards],
+			'resource_amounts': [card.resource_amount for card in cards],
+			'spawn_chances': [boss.get_spawn_chance() for boss in bosses],
+			'damages': [[boss.calculate_damage(card) for boss in bosses] for card in cards],
+			'resources': [[boss.calculate_resources(card).total() for boss in bosses] for card in cards],
+		}
+
+		for name, dtype in cls.fields:
+			arrays[name] = np.array(arrays[name], dtype=dtype)
+
+		arrays['damages'] = arrays['damages'].reshape(n, len(bosses))
+		arrays['resources'] = arrays['resources'].reshape(n, len(bosses))
+
+		return cls(arrays, cards)
+
+	def publish(self):
+		# copy the tables into one shared memory block and return a picklable descriptor
+		layout = []
+		offset = 0
+
+		for name, _ in self.fields:
+			array = self.arrays[name]
+			layout.append((name, array.dtype.str, array.shape, offset))
+			# keep every array 8-byte aligned
+			offset += (array.nbytes + 7) // 8 * 8
+
+		self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+
+		for name, dtype, shape, offset in layout:
+			shared = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+			shared[...] = self.arrays[name]
+			self.arrays[name] = shared
+			setattr(self, name, shared)
+
+		return {'name': self.shm.name, 'layout': layout}
+
+	@classmethod
+	def attach(cls, descriptor):
+		# pool workers share the publisher's resource tracker, so attaching never
+		# takes over ownership; the publisher alone unlinks the block
+		if sys.version_info >= (3, 13):
+			shm = shared_memory.SharedMemory(name=descriptor['name'], track=False)
+		else:
+			shm = shared_memory.SharedMemory(name=descriptor['name'])
+
+		arrays = {}
+
+		for name, dtype, shape, offset in descriptor['layout']:
+			arrays[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+
+		return cls(arrays, shm=shm)
+
+	def close(self, unlink=False):
+		if self.shm is None:
+			return
+
+		# drop the views before releasing the buffer they point into
+		self.arrays = {name: np.array(array) for name, array in self.arrays.items()}
+
+		for name, array in self.arrays.items():
+			setattr(self, name, array)
+
+		self.shm.close()
+
+		if unlink:
+			self.shm.unlink()
+
+		self.shm = None
+
+	@staticmethod
+	def rank_weights(size):
+		# the i-th strongest of size cards is the best card of a random hand with chance C(size-i, 2) / C(size, 3)
+		ranks = np.arange(1, size + 1)
+
+		return (size - ranks) * (size - ranks - 1) / 2 / math.comb(size, 3)
+
+	def expected_damage(self, damages, elements, size):
+		# damages is sorted strongest first per boss
+		bonus = 1.00 + 0.01 * elements
+
+		return bonus * (self.rank_weights(size) @ damages @ self.spawn_chances)
+
+	def deck_damage(self, indices):
+		indices = list(indices)
+		damages = -np.sort(-self.damages[indices], axis=0)
+
+		return self.expected_damage(damages, float(self.element_counts[indices].sum()), len(indices))
+
+	def deck_resources(self, indices):
+		# base wood and stone of a deck, as Deck.get_base_resources adds them up
+		indices = np.asarray(indices, dtype=np.intp)
+		hands = indices[np.array(list(itertools.combinations(range(len(indices)), 3)), dtype=np.intp).reshape(-1, 3)]
+		hand_amounts = self.resources[hands]
+
+		# the first card with the most resources wins each boss, like max() in Hand.get_score
+		best = hand_amounts.argmax(axis=1)
+		amounts = np.take_along_axis(hand_amounts, best[:, np.newaxis, :], axis=1)[:, 0, :]
+		is_wood = np.take_along_axis(self.resource_kinds[hands], best, axis=1) == Resource.WOOD.value
+
+		weighted = amounts * self.spawn_chances / math.comb(len(indices), 3)
+
+		return float(np.where(is_wood, weighted, 0).sum()), float(np.where(is_wood, 0, weighted).sum())
+
+	def score(self, masks):
+		# base wood, base stone and damage of every deck, given as roster bitmasks
+		scores = np.empty((len(masks), 3))
+
+		for i in range(len(masks)):
+			indices = [j for j in range(len(self)) if masks[i] >> j & 1]
+			wood, stone = self.deck_resources(indices)
+			scores[i] = (wood, stone, self.deck_damage(indices))
+
+		return scores
+
+# tables attached by a pool worker, see attach_worker
+worker_tables = None
+
+def attach_worker(descriptor):
+	global worker_tables
+	worker_tables = RosterTables.attach(descriptor)
+
+def score_worker(masks):
+	return worker_tables.score(masks)
+
+class BalanceTable():
+	# largest number of boss-hand pairs balanced in one numpy pass
+	max_batch = 1 << 21
+
+	def __init__(self, tables):
+		self.tables = tables
+		self.indices = tables.indices
+
+		n = len(tables)
+
+		# 1) resources of every card against every boss
+		amounts = tables.resources
+		is_wood = tables.resource_kinds == Resource.WOOD.value
+		self.spawn_chances = tables.spawn_chances
+
+		# 2) index every 3-card hand of the roster
+		triples = np.array(list(itertools.combinations(range(n), 3)), dtype=np.intp).reshape(-1, 3)
+		self.rows = np.full((n, n, n), -1, dtype=np.intp)
+		self.rows[triples[:, 0], triples[:, 1], triples[:, 2]] = np.arange(len(triples))
+
+		# 3) best wood, best stone and flip cost of every hand against every boss
+		hand_amounts = amounts[triples]
+		hand_wood = is_wood[triples]
+
+		self.best_wood = np.where(hand_wood[:, :, np.newaxis], hand_amounts, 0).max(axis=1)
+		self.best_stone = np.where(hand_wood[:, :, np.newaxis], 0, hand_amounts).max(axis=1)
+		self.flip_cost = np.abs(self.best_wood - self.best_stone)
+		self.flippable = hand_wood.any(axis=1) & ~hand_wood.all(axis=1)
+
+		# ties go to the first card of the hand, like the stable sort in BossHandPair
+		self.selects_wood = np.take_along_axis(hand_wood, hand_amounts.argmax(axis=1), axis=1)
+
+	def covers(self, deck):
+		return all(map(lambda c: id(c) in self.indices, deck.cards))
+
+	def balance(self, decks):
+		by_size = {}
+
+		for deck in decks:
+			by_size.setdefault(len(deck), []).append(deck)
+
+		for size, group in by_size.items():
+			hands = np.array(list(itertools.combinations(range(size), 3)), dtype=np.intp).reshape(-1, 3)
+			weights = np.outer(self.spawn_chances, np.full(len(hands), 1 / math.comb(size, 3))).ravel()
+			chunk = max(1, self.max_batch // max(1, weights.size))
+
+			for start in range(0, len(group), chunk):
+				self.balance_batch(group[start:start+chunk], hands, weights)
+
+	def balance_batch(self, decks, hands, weights):
+		# decks of one size, hands are the local index triples shared by all of them
+		indices = np.array([sorted(map(lambda c: self.indices[id(c)], deck.cards)) for deck in decks], dtype=np.intp)
+		hand_cards = indices[:, hands]
+		rows = self.rows[hand_cards[..., 0], hand_cards[..., 1], hand_cards[..., 2]]
+
+		def pairs(table):
+			# (deck, hand, boss) -> (deck, pair), boss-major like ComplexDeck.pairs
+			return table[rows].transpose(0, 2, 1).reshape(len(decks), -1)
+
+		best_wood = pairs(self.best_wood) * weights
+		best_stone = pairs(self.best_stone) * weights
+		selects_wood = pairs(self.selects_wood)
+		flip_cost = pairs(self.flip_cost)
+		flippable = pairs(np.broadcast_to(self.flippable[:, np.newaxis], self.flip_cost.shape))
+
+		# 1) default selections
+		wood = np.where(selects_wood, best_wood, 0).sum(axis=1)
+		stone = np.where(selects_wood, 0, best_stone).sum(axis=1)
+		diff = wood - stone
+		direction = np.sign(diff)[:, np.newaxis]
+
+		# 2) pairs currently gaining the surplus resource can be flipped
+		selected = np.where(selects_wood, best_wood, best_stone)
+		candidates = flippable & (selected > 0) & (selects_wood == (direction > 0)) & (direction != 0)
+
+		# 3) sort by flip cost, then flip while the delta keeps shrinking
+		order = np.argsort(np.where(candidates, flip_cost, np.inf), axis=1, kind='stable')
+		flip_wood = np.take_along_axis(np.where(candidates, best_wood, 0), order, axis=1)
+		flip_stone = np.take_along_axis(np.where(candidates, best_stone, 0), order, axis=1)
+
+		deltas = np.abs(diff[:, np.newaxis] - direction * np.cumsum(flip_wood + flip_stone, axis=1))
+		deltas = np.concatenate((np.abs(diff)[:, np.newaxis], deltas), axis=1)
+		# the cumsum here and ComplexDeck's one flip at a time round differently, so
+		# a flip that leaves the delta unchanged up to float noise can be taken by one
+		# path and not the other; check_search.py's 1e-4 tolerance absorbs those ties
+		improving = deltas[:, 1:] < deltas[:, :-1]
+		flips = np.where(improving.all(axis=1), improving.shape[1], improving.argmin(axis=1))
+		flipped = np.arange(order.shape[1])[np.newaxis, :] < flips[:, np.newaxis]
+
+		wood -= direction[:, 0] * (flip_wood * flipped).sum(axis=1)
+		stone += direction[:, 0] * (flip_stone * flipped).sum(axis=1)
+
+		for i in range(len(decks)):
+			deck = decks[i]
+			deck.resources = ResourceContainer(wood=float(wood[i]), stone=float(stone[i]))
+			deck.score = min(deck.resources.wood, deck.resources.stone) * 2
+
+class DamageSearch():
+	# A deck's expected damage only depends on how its cards rank against each
+	# boss: the i-th strongest of n cards is the best card of a random hand with
+	# chance C(n-i, 2) / C(n, 3). That makes exact branch and bound cheap.
+	def __init__(self, tables):
+		self.tables = tables
+
+		n = len(tables)
+
+		self.damages = tables.damages
+		self.spawn_chances = tables.spawn_chances
+		self.elements = tables.element_counts.astype(float)
+
+		# branch on the strongest cards first so good decks are found early
+		self.order = np.argsort(-(self.damages @ self.spawn_chances), kind='stable')
+
+		# per-boss damages and element counts of every suffix of the branching order, strongest first
+		self.suffix_damages = []
+		self.suffix_elements = []
+
+		for pos in range(n + 1):
+			pool = self.order[pos:]
+			self.suffix_damages.append(-np.sort(-self.damages[pool], axis=0))
+			self.suffix_elements.append(-np.sort(-self.elements[pool]))
+
+		# a card at least as strong against every boss with at least as many elements
+		# dominates: swapping it in never hurts, so some best deck holding the weaker
+		# card also holds the stronger one. Identical cards dominate in branching order.
+		position = np.empty(n, dtype=np.intp)
+		position[self.order] = np.arange(n)
+		stronger = (self.damages[:, np.newaxis, :] >= self.damages[np.newaxis, :, :]).all(axis=2) & (self.elements[:, np.newaxis] >= self.elements[np.newaxis, :])
+
+		self.dominators = [0] * n
+		self.dominated = [0] * n
+
+		for a, b in zip(*np.nonzero(stronger)):
+			if a == b or (stronger[b, a] and position[a] > position[b]):
+				continue
+
+			self.dominators[b] |= 1 << int(a)
+			self.dominated[a] |= 1 << int(b)
+
+	def damage(self, indices):
+		return self.tables.deck_damage(indices)
+
+	def bound(self, chosen, pos, size):
+		# every boss takes its best remaining cards independently, as does the collection bonus
+		need = size - len(chosen)
+		damages = np.concatenate((self.damages[chosen], self.suffix_damages[pos][:need]))
+		damages = -np.sort(-damages, axis=0)
+		elements = self.elements[chosen].sum() + self.suffix_elements[pos][:need].sum()
+
+		return self.tables.expected_damage(damages, elements, size)
+
+	def solve(self, size, incumbent=None, floor=-math.inf):
+		# roster indices and damage of the highest damage deck of the given size
+		n = len(self.tables)
+
+		if incumbent is None:
+			incumbent = list(range(size))
+
+		best = list(incumbent)
+		best_damage = self.damage(best)
+		# only decks beating floor matter to the caller, so prune against it too
+		threshold = max(best_damage, floor)
+
+		# depth-first over include/exclude decisions in branching order, the masks
+		# track chosen and excluded cards for the dominance rules
+		stack = [([], 0, 0, 0)]
+		nodes = 0
+		pruned = 0
+
+		while stack:
+			chosen, chosen_mask, excluded_mask, pos = stack.pop()
+			nodes += 1
+
+			if len(chosen) == size:
+				damage = self.damage(chosen)
+
+				if damage > best_damage:
+					best = chosen
+					best_damage = damage
+					threshold = max(best_damage, floor)
+
+				continue
+
+			if n - pos < size - len(chosen):
+				continue
+
+			if self.bound(chosen, pos, size) <= threshold:
+				pruned += 1
+				continue
+
+			card = int(self.order[pos])
+			bit = 1 << card
+
+			# never drop a card while holding one it dominates, nor take a card whose dominator was dropped
+			if not self.dominated[card] & chosen_mask:
+				stack.append((chosen, chosen_mask, excluded_mask | bit, pos + 1))
+			if not self.dominators[card] & excluded_mask:
+				stack.append((chosen + [card], chosen_mask | bit, excluded_mask, pos + 1))
+
+		telemetry.increment('states_generated', nodes)
+		telemetry.increment('states_pruned', pruned)
+
+		if __debug__:
+			logging.debug("{}-card search: {} nodes, {} pruned, best {:.3f}".format(size, nodes, pruned, best_damage))
+
+		return sorted(best), best_damage
+
+	def solve_all(self, min_size=10, max_size=None):
+		# best deck of every size from the full roster (or max_size) down to min_size
+		n = len(self.tables)
+		top = n if max_size is None else min(max_size, n)
+		results = {}
+		incumbent = sorted(map(int, self.order[:top]))
+
+		for size in range(top, min(min_size, top) - 1, -1):
+			if size < top:
+				# seed the bound with the larger optimum minus its least useful card
+				incumbent = max(map(lambda i: incumbent[:i] + incumbent[i+1:], range(len(incumbent))), key=self.damage)
+
+			incumbent, damage = self.solve(size, incumbent)
+			results[size] = (incumbent, damage)
+
+		return results
+
+	def solve_best(self, min_size=10, max_size=None):
+		# the best deck of any size; sizes that cannot beat the best deck so far are
+		# pruned as a whole, which skips most of the small sizes solve_all visits
+		n = len(self.tables)
+		top = n if max_size is None else min(max_size, n)
+		best = None
+		best_damage = -math.inf
+
+		for size in range(top, min(min_size, top) - 1, -1):
+			if self.bound([], 0, size) <= best_damage:
+				telemetry.increment('states_pruned')
+				continue
+
+			incumbent = sorted(map(int, self.order[:size]))
+			indices, damage = self.solve(size, incumbent, floor=best_damage)
+
+			if damage > best_damage:
+				best = indices
+				best_damage = damage
+
+		return best, best_damage
+
 class Deck:
 	def __init__(self, app, cards):
 		self.cards = cards
@@ -315,24 +759,31 @@ class Deck:
 
 		return self.hands
 
-	def get_score(self):
-		if not hasattr(self, 'score'):
+	def get_base_resources(self):
+		if not hasattr(self, 'base_resources'):
 			if __debug__:
 				logging.debug("Scoring {}...".format(self))
 
-			self.resources = ResourceContainer()
+			telemetry.increment('states_scored', objective='resources')
 
-			for hand in self.get_hands():
-				self.resources += hand.get_score()
+			with telemetry.Phase('scoring'):
+				self.base_resources = ResourceContainer()
+
+				for hand in self.get_hands():
+					self.base_resources += hand.get_score()
 
 			if __debug__:
-				logging.debug("{} deck resources: {}".format(self, self.resources))
+				logging.debug("{} deck resources: {}".format(self, self.base_resources))
+
+		return self.base_resources
+
+	def get_score(self):
+		if not hasattr(self, 'score'):
+			self.resources = self.get_base_resources()
 
 			self.base_score = self.resources.total()
 			self.base_delta = self.resources.delta()
-			#self.score = self.base_score - self.base_delta * 0.0842
-			#self.score = self.base_score - 0.11424 * (self.base_delta / 1.36) ** 3.475
-			self.score = self.base_score - 0.96 * self.base_delta ** 2 / self.base_score
+			self.score = OBJECTIVES[self.app.objective](self.base_score, self.base_delta, self.app.penalty)
 
 			if __debug__:
 				logging.debug("Deck score: {}".format(self.score))
@@ -341,19 +792,33 @@ class Deck:
 
 	def get_damage(self):
 		if not hasattr(self, 'damage'):
-			self.damage = 0
+			telemetry.increment('states_scored', objective='damage')
+
+			with telemetry.Phase('damage'):
+				self.damage = 0
 
-			for hand in self.get_hands():
-				self.damage += hand.get_damage() * hand.draw_chance
+				for hand in self.get_hands():
+					self.damage += hand.get_damage() * hand.draw_chance
 
-			self.damage *= self.get_collection_bonus()
+				self.damage *= self.get_collection_bonus()
 
 		return self.damage
 
 	def minimize_delta(self):
+		with telemetry.Phase('minimize_delta'):
+			self._minimize_delta()
+
+	def _minimize_delta(self):
 		if __debug__:
 			logging.debug("Minimizing delta on {}...".format(self))
 
+		if not self.app.dump_score_data:
+			table = self.app.get_balance_table()
+
+			if table.covers(self):
+				table.balance([self])
+				return
+
 		# 1) create complex deck
 		cd = ComplexDeck(self)
 
@@ -410,6 +875,8 @@ class Deck:
 			del self.hands
 		if hasattr(self, 'score'):
 			del self.score
+		if hasattr(self, 'base_resources'):
+			del self.base_resources
 		if hasattr(self, 'damage'):
 			del self.damage
 		if hasattr(self, 'collection_bonus'):
@@ -429,10 +896,10 @@ class Card:
 		return "<Card-{}-{}{}>".format("".join(map(lambda e: e.short(), self.elements)), self.resource.short(), self.resource_amount)
 
 	@classmethod
-	def random(cls, minE=1, maxE=4, minR=0, maxR=4):
-		elements = random.choices(list(Element), k=random.randint(minE,maxE))
-		resource = random.choice((Resource.WOOD, Resource.STONE))
-		resource_amount = random.randint(minR, maxR)
+	def random(cls, minE=1, maxE=4, minR=0, maxR=4, rng=random):
+		elements = rng.choices(list(Element), k=rng.randint(minE,maxE))
+		resource = rng.choice((Resource.WOOD, Resource.STONE))
+		resource_amount = rng.randint(minR, maxR)
 
 		if __debug__:
 			logging.debug(elements)
@@ -536,18 +1003,48 @@ class Boss:
 		return ResourceContainer.create(total_amount, card_resource)
 
 	@classmethod
-	def random(cls, app):
-		elements = random.choices(list(Element), k=random.randint(1,4))
+	def random(cls, app, rng=random):
+		elements = rng.choices(list(Element), k=rng.randint(1,4))
 
 		return cls(app, elements)
 
+telemetry.register_cache('hit_multiplier', Boss.get_hit_multiplier.cache_info)
+telemetry.register_cache('card_damage', Boss.__calculate_damage__.cache_info)
+telemetry.register_cache('card_resources', Boss.__calculate_resources__.cache_info)
+
 class AppState:
 	def __init__(self):
 		self.hand_cache = {}
 
 		self.dump_score_data = False
 		self.use_random_deck = False
+		self.print_rankings = True
+
+		# deck objective used to rank candidates before their deltas are minimized
+		self.objective = 'quadratic'
+		self.penalty = 0.96
 		self.score_data = {}
+		self.results_path = None
+		# which ranking write_results streams, see RESULTS_RANKINGS
+		self.results_ranking = 'candidates'
+		self.balance_batch_size = 256
+
+		# worker processes for scoring whole enumerations, 1 keeps everything in-process
+		self.processes = 1
+		self.score_chunk_size = 512
+
+		# exact branch and bound search instead of the combinations_recursive heuristic;
+		# ranking every deck size grows exponentially with the roster, so larger rosters
+		# use the heuristic when rankings are printed or balanced
+		self.exact_damage = True
+		self.exact_damage_limit = 48
+
+		# largest deck to keep after drawing, None lets the deck grow every round
+		self.max_deck_size = None
+
+		# source of random draws; simulations swap in a seeded random.Random
+		self.rng = random
+		self.history = []
 
 	@cached_property
 	def bosses(self):
@@ -595,33 +1092,80 @@ class AppState:
 
 		if self.use_random_deck:
 			for i in range(10):
-				cards.append(Card.random())
+				cards.append(Card.random(rng=self.rng))
 		else:
-			with open(path, 'r') as f:
-				raw_cards = f.read()
+			for record in rally_format.load_roster(path):
+				elements = list(map(lambda e: Element(int(e)), record['elements'][:record['n_elements']]))
+				resource = Resource(int(record['resource']))
+				resource_amount = int(record['amount'])
 
-				raw_cards = raw_cards.split('\n')
+				if __debug__:
+					logging.debug("Parsed card: {} {} {}".format(elements, resource_amount, resource))
+
+				cards.append(Card(elements, resource, resource_amount))
 
-				for line in raw_cards:
-					if __debug__:
-						logging.debug("Parsing line: {}".format(line))
+		self.deck = Deck(self, cards)
 
-					fields = line.split('\t')
+	def get_roster_tables(self):
+		roster = tuple(map(id, self.deck.cards))
 
-					elements = list(map(lambda e: Element[e], fields[0]))
+		if getattr(self, 'compiled_roster', None) != roster:
+			self.roster_tables = RosterTables.compile(self, self.deck.cards)
+			self.compiled_roster = roster
 
-					if __debug__:
-						logging.debug("Elements: {}".format(elements))
+			if hasattr(self, 'balance_table'):
+				del self.balance_table
 
-					resource = Resource[fields[1][:1]]
-					resource_amount = int(fields[1][1:2])
+		return self.roster_tables
 
-					if __debug__:
-						logging.debug("Resource: {} {}".format(resource_amount, resource))
+	def get_balance_table(self):
+		tables = self.get_roster_tables()
 
-					cards.append(Card(elements, resource, resource_amount))
+		if not hasattr(self, 'balance_table'):
+			self.balance_table = BalanceTable(tables)
 
-		self.deck = Deck(self, cards)
+		return self.balance_table
+
+	def score_decks(self, decks):
+		# score base resources and damage of roster decks across worker processes
+		tables = self.get_roster_tables()
+		masks = list(map(lambda d: sum(map(lambda c: 1 << tables.indices[id(c)], d.cards)), decks))
+		chunks = [masks[i:i+self.score_chunk_size] for i in range(0, len(masks), self.score_chunk_size)]
+		scores = []
+
+		# workers attach to the tables by name instead of unpickling the roster
+		descriptor = tables.publish()
+
+		try:
+			with multiprocessing.Pool(self.processes, initializer=attach_worker, initargs=(descriptor,)) as pool:
+				for chunk_scores in progressbar.progressbar(pool.imap(score_worker, chunks), max_value=len(chunks)):
+					scores.append(chunk_scores)
+		finally:
+			tables.close(unlink=True)
+
+		scores = np.concatenate(scores) if scores else np.empty((0, 3))
+
+		for i in range(len(decks)):
+			decks[i].base_resources = ResourceContainer(wood=float(scores[i, 0]), stone=float(scores[i, 1]))
+			decks[i].damage = float(scores[i, 2])
+
+		telemetry.increment('states_scored', len(decks), objective='shared')
+
+	def balance_decks(self, decks):
+		if self.dump_score_data:
+			for deck in decks:
+				deck.minimize_delta()
+			return
+
+		table = self.get_balance_table()
+		covered = list(filter(table.covers, decks))
+
+		with telemetry.Phase('minimize_delta'):
+			table.balance(covered)
+
+		for deck in decks:
+			if not table.covers(deck):
+				deck.minimize_delta()
 
 	evaluated = 0
 
@@ -629,7 +1173,10 @@ class AppState:
 		#logging.info("recursing {}".format(len(source_deck)-1))
 
 		for cards in itertools.combinations(source_deck.cards, len(source_deck)-1):
+			telemetry.increment('states_generated')
+
 			if frozenset(cards) in candidates:
+				telemetry.increment('states_deduplicated')
 				continue
 
 			deck = Deck(source_deck.app, list(cards))
@@ -638,25 +1185,70 @@ class AppState:
 
 			self.evaluated += 1
 
-			if len(deck) > 10 and deck.get_damage() > source_deck.get_damage():
+			# decks over max_deck_size must keep shedding cards, even at a loss
+			oversized = self.max_deck_size is not None and len(deck) > self.max_deck_size
+
+			if len(deck) > 10 and (oversized or deck.get_damage() > source_deck.get_damage()):
 				#logging.info("{} {} vs {} {}".format(deck, deck.get_damage(), source_deck, source_deck.get_damage()))
 				self.combinations_recursive(deck, candidates)
+			else:
+				telemetry.increment('states_pruned')
+
+
+	def search_damage(self, all_sizes=True):
+		search = DamageSearch(self.get_roster_tables())
+		deck_options = []
 
+		if not all_sizes:
+			logging.info("Searching for the best deck...")
+
+			indices, damage = search.solve_best(max_size=self.max_deck_size)
+			deck = Deck(self, list(map(lambda i: self.deck.cards[i], indices)))
+			deck.damage = damage
+
+			logging.info("Best deck: {} cards, {:.1f} damage".format(len(deck), damage))
+
+			return [deck]
+
+		logging.info("Searching for the best deck of each size...")
+
+		for size, (indices, damage) in search.solve_all(max_size=self.max_deck_size).items():
+			deck = Deck(self, list(map(lambda i: self.deck.cards[i], indices)))
+			deck.damage = damage
+			deck_options.append(deck)
+
+			logging.info("Best {}-card deck: {:.1f} damage".format(size, damage))
+
+		return deck_options
 
 	def maximize_damage(self, true_scores=True):
-		logging.info("Creating deck combinations...")
-		cards_set = set()
-		cards_set.add(frozenset(self.deck.cards))
+		with telemetry.Phase('maximize_damage'):
+			self._maximize_damage(true_scores)
 
-		self.evaluated = 1
-		self.combinations_recursive(self.deck, cards_set)
+	def _maximize_damage(self, true_scores):
+		# without rankings to print or balance only the best deck is needed
+		all_sizes = true_scores or self.print_rankings
 
-		logging.info("Evaluated {} deck options.".format(self.evaluated))
+		if self.exact_damage and (not all_sizes or len(self.deck) <= self.exact_damage_limit):
+			deck_options = self.search_damage(all_sizes)
+		else:
+			logging.info("Creating deck combinations...")
+			cards_set = set()
+			cards_set.add(frozenset(self.deck.cards))
+
+			self.evaluated = 1
+			self.combinations_recursive(self.deck, cards_set)
+
+			logging.info("Evaluated {} deck options.".format(self.evaluated))
 
-		logging.info("Constructing deck list...")
+			logging.info("Constructing deck list...")
 
-		cards_list = list(cards_set)
-		deck_options = list(map(lambda cards: Deck(self, list(cards)), cards_list))
+			cards_list = list(cards_set)
+
+			if self.max_deck_size is not None:
+				cards_list = list(filter(lambda cards: len(cards) <= self.max_deck_size, cards_list))
+
+			deck_options = list(map(lambda cards: Deck(self, list(cards)), cards_list))
 
 		logging.info("Sorting decks...")
 		deck_options.sort(key=lambda d: d.get_damage(), reverse=True)
@@ -664,49 +1256,70 @@ class AppState:
 		if true_scores:
 			logging.info("Minimizing deltas..")
 
-			for deck in progressbar.progressbar(deck_options[:5]):
-				deck.minimize_delta()
+			self.balance_decks(deck_options[:5])
 
-		for deck in deck_options[:5]:
-			deck.get_damage()
-			deck.get_score()
+		if self.print_rankings:
+			for deck in deck_options[:5]:
+				deck.get_damage()
+				deck.get_score()
 
-		print("============================ Damage Rankings =========================================================")
-		print("RNK\tDMG\tSCORE\tRESOURCES                    \tDESCRIPTION")
-		print("======================================================================================================")
-		for deck in deck_options[:5]:
-			print("#{}\t{:.1f}\t{:.3f}\t{}\t{}".format(deck_options.index(deck)+1, deck.get_damage(), deck.get_score(), deck.resources, deck))
+			print("============================ Damage Rankings =========================================================")
+			print("RNK\tDMG\tSCORE\tRESOURCES                    \tDESCRIPTION")
+			print("======================================================================================================")
+			for deck in deck_options[:5]:
+				print("#{}\t{:.1f}\t{:.3f}\t{}\t{}".format(deck_options.index(deck)+1, deck.get_damage(), deck.get_score(), deck.resources, deck))
 
 		self.deck = deck_options[0]
 
 	def maximize_resources(self):
+		with telemetry.Phase('maximize_resources'):
+			self._maximize_resources()
+
+	def _maximize_resources(self):
+		roster = self.deck.cards
 		deck_options = []
 
 		for deck_size in range(len(self.deck), 9, -1):
 			#logging.info("Deck size: {}".format(deck_size))
 
 			for cards in itertools.combinations(self.deck.cards, deck_size):
-				deck = Deck(self, list(cards))
-				new_score = deck.get_score()
+				telemetry.increment('states_generated')
 
-				if __debug__:
-					logging.debug(deck)
-					logging.debug("New score: {}".format(new_score))
+				deck_options.append(Deck(self, list(cards)))
+
+		if self.processes > 1:
+			self.score_decks(deck_options)
 
-				deck_options.append(deck)
+		for deck in deck_options:
+			new_score = deck.get_score()
+
+			if __debug__:
+				logging.debug(deck)
+				logging.debug("New score: {}".format(new_score))
 
 		deck_options.sort(key=lambda d: d.get_score(), reverse=True)
 
 		highest_score = 0
 		true_decks = []
+		balanced = set()
 
 		for i in progressbar.progressbar(range(len(deck_options))):
 			deck = deck_options[i]
 
-			if deck.resources.total() < highest_score:
+			if deck.get_base_resources().total() < highest_score:
+				telemetry.increment('states_pruned')
 				continue
 
-			deck.minimize_delta()
+			if self.dump_score_data:
+				# the ComplexDeck path dumps every deck it balances, so only balance survivors
+				deck.minimize_delta()
+			elif id(deck) not in balanced:
+				# balance the next batch of survivors together through the shared table;
+				# any the finished scores later prune are simply dropped
+				batch = list(filter(lambda d: d.get_base_resources().total() >= highest_score, deck_options[i:i+self.balance_batch_size]))
+				self.balance_decks(batch)
+				balanced.update(map(id, batch))
+
 			true_decks.append(deck)
 
 			if deck.get_score() > highest_score:
@@ -721,6 +1334,12 @@ class AppState:
 		for deck in true_decks[:10]:
 			print("#{}\t#{}\t{:.3f}\t{}\t{}".format(true_decks.index(deck)+1, deck_options.index(deck)+1, deck.get_score(), deck.resources, deck))
 
+		if self.results_path:
+			if self.results_ranking == 'candidates':
+				self.write_results(self.results_path, roster, self.result_records(deck_options, balanced=False))
+			else:
+				self.write_results(self.results_path, roster, self.result_records(true_decks, balanced=True))
+
 		if self.dump_score_data:
 			with open('scores.json', 'w') as f:
 				json.dump(self.score_data, f, indent=4, sort_keys=True)
@@ -729,36 +1348,344 @@ class AppState:
 
 		self.deck = true_decks[0]
 
-	def run(self):
-		for draws in range(999999):
+	def result_records(self, decks, balanced):
+		# yields (mask, score, wood, stone, damage) per deck in order, so the writer
+		# never holds more than its chunk; damage comes from the roster tables
+		tables = self.get_roster_tables()
+
+		for deck in decks:
+			indices = list(map(lambda c: tables.indices[id(c)], deck.cards))
+			mask = sum(map(lambda i: 1 << i, indices))
+			damage = deck.damage if hasattr(deck, 'damage') else tables.deck_damage(indices)
+
+			if balanced:
+				yield mask, deck.get_score(), deck.resources.wood, deck.resources.stone, damage
+			else:
+				# survivors were balanced in place, rank every deck by its base resources
+				resources = deck.get_base_resources()
+				score = OBJECTIVES[self.objective](resources.total(), resources.delta(), self.penalty)
+
+				yield mask, score, resources.wood, resources.stone, damage
+
+	def write_results(self, path, roster, records):
+		if len(roster) > rally_format.MAX_ROSTER:
+			raise ValueError("results hold decks from rosters of at most {} cards, got {}".format(rally_format.MAX_ROSTER, len(roster)))
+
+		with rally_format.ResultWriter(path) as writer:
+			for cards, score, wood, stone, damage in records:
+				writer.write(cards, score, wood, stone, damage)
+
+		logging.info("Wrote {} ranked decks to {}.".format(writer.count, path))
+
+	def sweep_objectives(self, formulas, penalties=None, top=10):
+		logging.info("Scoring deck combinations...")
+
+		decks = []
+
+		for deck_size in range(len(self.deck), 9, -1):
+			for cards in itertools.combinations(self.deck.cards, deck_size):
+				telemetry.increment('states_generated')
+				decks.append(Deck(self, list(cards)))
+
+		if self.processes > 1:
+			self.score_decks(decks)
+
+		wood = np.empty(len(decks))
+		stone = np.empty(len(decks))
+
+		for i in progressbar.progressbar(range(len(decks))):
+			resources = decks[i].get_base_resources()
+			wood[i] = resources.wood
+			stone[i] = resources.stone
+
+		total = wood + stone
+		delta = np.abs(wood - stone)
+		positions = np.arange(len(decks))
+
+		# the balanced score is what an objective should predict, balance every deck for reference
+		logging.info("Balancing deck combinations...")
+
+		for i in progressbar.progressbar(range(0, len(decks), self.balance_batch_size)):
+			self.balance_decks(decks[i:i+self.balance_batch_size])
+
+		true_scores = np.array(list(map(lambda d: d.get_score(), decks)))
+
+		def rank(scores):
+			# order[g] lists deck indices best first, ranks[g] maps a deck index to its position
+			order = np.argsort(-scores, axis=-1, kind='stable')
+			ranks = np.empty_like(order)
+			np.put_along_axis(ranks, order, np.broadcast_to(positions, order.shape), axis=-1)
+
+			return order, ranks
+
+		with np.errstate(divide='ignore', invalid='ignore'):
+			baseline = OBJECTIVES[self.objective](total, delta, self.penalty)
+
+		base_order, base_ranks = rank(baseline)
+		base_top = base_order[:top]
+		true_order, true_ranks = rank(true_scores)
+		true_top = true_order[:top]
+
+		print("================================== Balanced Ranking ======================================================")
+		print("RNK\tSCORE\tOBJ RNK\tRESOURCES                     \tDESCRIPTION")
+		print("===========================================================================================================")
+
+		for i in range(len(true_top)):
+			deck = decks[true_top[i]]
+			print("#{}\t{:.3f}\t#{}\t{}\t{}".format(i+1, true_scores[true_top[i]], base_ranks[true_top[i]]+1, deck.resources, deck))
+
+		# TOP, SHIFT and #1 TRUE measure each objective against the balanced ranking,
+		# CURRENT is its top overlap with the current objective
+		print("================================== Objective Sweep =======================================================")
+		print("FORMULA  \tPENALTY\tTOP{}\tSHIFT\t#1 TRUE\tCURRENT\tBEST".format(top))
+		print("===========================================================================================================")
+
+		for formula in formulas:
+			grid = np.asarray(OBJECTIVE_PENALTIES[formula] if penalties is None else penalties, dtype=float)
+
+			# one pass scores every deck under every penalty in the grid
+			with np.errstate(divide='ignore', invalid='ignore'):
+				scores = OBJECTIVES[formula](total[np.newaxis, :], delta[np.newaxis, :], grid[:, np.newaxis])
+
+			order, ranks = rank(scores)
+
+			for g in range(len(grid)):
+				grid_top = order[g, :top]
+				overlap = len(np.intersect1d(grid_top, true_top))
+				shift = np.mean(np.abs(ranks[g, true_top] - positions[:len(true_top)]))
+				current = len(np.intersect1d(grid_top, base_top))
+				best = grid_top[0]
+
+				print("{:9}\t{:.5g}\t{}/{}\t{:.1f}\t#{}\t{}/{}\t{}".format(formula, grid[g], overlap, len(true_top), shift, true_ranks[best]+1, current, len(base_top), decks[best]))
+
+	def run(self, rounds=999999):
+		for draws in range(rounds):
 			logging.info("Round {}".format(draws+1))
 			drew = []
 
 			# draw 3 cards
 			for i in range(3):
-				#card = Card.random(minE=4, minR=4)
-				card = Card.random(minE=2)
+				#card = Card.random(minE=4, minR=4, rng=self.rng)
+				card = Card.random(minE=2, rng=self.rng)
 
 				drew.append(card)
 				self.deck.add_card(card)
 
 			logging.info("Drew cards: {}".format(drew))
 
+			# the search compiles these anyway, the history reads the kept deck from them
+			tables = self.get_roster_tables()
+			positions = {id(card): i for i, card in enumerate(self.deck.cards)}
+
 			self.maximize_damage(true_scores=False)
 
+			indices = list(map(lambda card: positions[id(card)], self.deck.cards))
+			wood, stone = tables.deck_resources(indices)
+			damage = tables.deck_damage(indices)
+
 			logging.info("Current deck: {}".format(self.deck.cards))
 
+			telemetry.set_gauge('round', draws+1)
+			telemetry.set_gauge('deck_size', len(self.deck))
+			telemetry.set_gauge('deck_damage', damage)
+
+			self.history.append({
+				'damage': damage,
+				'score': OBJECTIVES[self.objective](wood + stone, abs(wood - stone), self.penalty),
+				'wood': wood,
+				'stone': stone,
+				'size': len(self.deck),
+			})
+
 		#self.maximize_damage()
 
+def parse_bool(value):
+	if value.lower() in ('1', 'true', 'yes', 'on'):
+		return True
+	if value.lower() in ('0', 'false', 'no', 'off'):
+		return False
+
+	raise ValueError("expected true or false, got {!r}".format(value))
+
+def parse_objective(value):
+	if value not in OBJECTIVES:
+		raise ValueError("expected one of {}, got {!r}".format(", ".join(sorted(OBJECTIVES)), value))
+
+	return value
+
+def parse_size(value):
+	return None if value.lower() == 'none' else int(value)
+
+# candidates: every enumerated deck in objective order, with base resources
+# balanced: the decks that survived pruning, balanced as in the printed table
+RESULTS_RANKINGS = ('candidates', 'balanced')
+
+# AppState settings a simulated strategy can override
+STRATEGY_SETTINGS = {
+	'exact_damage': parse_bool,
+	'exact_damage_limit': int,
+	'max_deck_size': parse_size,
+	'objective': parse_objective,
+	'penalty': float,
+}
+
+def parse_strategy(text):
+	# "NAME:key=value,key=value", e.g. "heuristic:exact_damage=false,max_deck_size=24"
+	name, _, fields = text.partition(':')
+
+	if not name:
+		raise argparse.ArgumentTypeError("strategy {!r} has no name".format(text))
+
+	settings = {}
+
+	for field in filter(None, fields.split(',')):
+		key, _, value = field.partition('=')
+
+		if key not in STRATEGY_SETTINGS:
+			raise argparse.ArgumentTypeError("strategy {}: unknown setting {!r}, expected one of {}".format(name, key, ", ".join(sorted(STRATEGY_SETTINGS))))
+
+		try:
+			settings[key] = STRATEGY_SETTINGS[key](value)
+		except ValueError as e:
+			raise argparse.ArgumentTypeError("strategy {}: {}: {}".format(name, key, e))
+
+	return name, settings
+
+def simulate_trajectory(job):
+	path, seed, rounds, strategy, settings = job
 
+	# workers stay quiet, the parent reports the aggregate
+	logging.getLogger().setLevel(logging.WARNING)
 
+	app = AppState()
+	app.rng = random.Random(seed)
+	app.print_rankings = False
+	app.load(path)
 
-app = AppState()
-app.load('input.txt')
+	for key, value in settings.items():
+		setattr(app, key, value)
 
-start_time = time.time()
+	before, _ = telemetry.snapshot()
+	start = time.time()
+	app.run(rounds)
+	duration = time.time() - start
+	after, _ = telemetry.snapshot()
 
-app.run()
+	# pool workers are reused, so report only what this trajectory added
+	return strategy, seed, app.history, duration, telemetry.difference(after, before)
 
-logging.info("Execution time: {:.3f}s".format(time.time() - start_time))
-profile_tools.log_digest()
\ No newline at end of file
+def simulate(path, trajectories, rounds, seed=0, processes=None, strategies=(('default', {}),)):
+	# every strategy replays the same seeds, so they face the same draws
+	jobs = [(path, seed + i, rounds, name, settings) for name, settings in strategies for i in range(trajectories)]
+	results = []
+
+	logging.info("Simulating {} trajectories of {} rounds for {} strategies...".format(trajectories, rounds, len(strategies)))
+
+	start = time.time()
+
+	with multiprocessing.Pool(processes) as pool:
+		for result in progressbar.progressbar(pool.imap_unordered(simulate_trajectory, jobs), max_value=len(jobs)):
+			telemetry.merge(result[4])
+			results.append(result)
+
+	duration = time.time() - start
+
+	results.sort(key=lambda r: r[1])
+
+	curves = {}
+
+	for name, settings in strategies:
+		histories = list(map(lambda r: r[2], filter(lambda r: r[0] == name, results)))
+		curves[name] = []
+
+		for i in range(rounds):
+			samples = list(map(lambda h: h[i], histories))
+			curve = {}
+
+			for key in ('damage', 'score', 'wood', 'stone', 'size'):
+				values = list(map(lambda s: s[key], samples))
+				curve[key] = (mean(values), pstdev(values))
+
+			curves[name].append(curve)
+
+	print("================================== Simulation ============================================================")
+	print("STRATEGY\tRND\tDMG\t(SD)\tSCORE\t(SD)\tWOOD\tSTONE\tSIZE")
+	print("===========================================================================================================")
+
+	for name, settings in strategies:
+		for i in range(rounds):
+			curve = curves[name][i]
+			print("{}\t#{}\t{:.1f}\t{:.1f}\t{:.3f}\t{:.3f}\t{:.3f}\t{:.3f}\t{:.1f}".format(name, i+1, curve['damage'][0], curve['damage'][1], curve['score'][0], curve['score'][1], curve['wood'][0], curve['stone'][0], curve['size'][0]))
+
+	total_rounds = len(jobs) * rounds
+	worker_time = sum(map(lambda r: r[3], results))
+
+	logging.info("Simulated {} rounds in {:.3f}s ({:.2f} rounds/s, {:.2f} rounds/s per worker).".format(total_rounds, duration, total_rounds / duration, total_rounds / worker_time))
+
+	return curves
+
+
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Optimize a rally boss deck.")
+	parser.add_argument('input', nargs='?', default='input.txt', help="tab-separated card list")
+	parser.add_argument('--simulate', type=int, metavar='N', help="run N seeded trajectories instead of the interactive loop")
+	parser.add_argument('--sweep', action='store_true', help="compare deck rankings across a grid of objectives")
+	parser.add_argument('--formulas', nargs='+', choices=sorted(OBJECTIVES), default=sorted(OBJECTIVES), help="objective formulas to sweep")
+	parser.add_argument('--penalties', nargs='+', type=float, help="penalty coefficients to sweep for every formula (defaults to a grid per formula around its tuned coefficient)")
+	parser.add_argument('--rounds', type=int, default=20, help="rounds per simulated trajectory")
+	parser.add_argument('--strategy', action='append', type=parse_strategy, metavar='NAME:KEY=VALUE,...', help="simulate a named strategy overriding {} (repeatable, all strategies replay the same seeds)".format(", ".join(sorted(STRATEGY_SETTINGS))))
+	parser.add_argument('--max-deck-size', type=parse_size, metavar='N', help="largest deck simulated strategies keep unless they set max_deck_size; by default the deck grows 2-3 cards a round, about 60 cards after 20 rounds")
+	parser.add_argument('--seed', type=int, default=0, help="seed of the first simulated trajectory")
+	parser.add_argument('--processes', type=int, help="worker processes (defaults to the CPU count)")
+	parser.add_argument('--results', metavar='PATH', help="maximize resources once and write the ranked decks to a binary results file")
+	parser.add_argument('--results-ranking', choices=RESULTS_RANKINGS, default='candidates', help="decks --results writes: every candidate in objective order with base resources, or only the balanced survivors shown in the printed table")
+	parser.add_argument('--convert', metavar='OUT', help="write the input card list to a binary roster file")
+	parser.add_argument('--convert-scores', nargs=2, metavar=('JSON', 'OUT'), help="convert a scores.json dump of the input roster to a binary results file")
+	parser.add_argument('--metrics-interval', type=float, default=60, metavar='SECONDS', help="log a JSON metrics line this often (0 disables)")
+	parser.add_argument('--metrics-port', type=int, help="serve Prometheus-style metrics on this local port")
+	args = parser.parse_args()
+
+	if args.metrics_interval > 0:
+		telemetry.start_reporter(args.metrics_interval)
+
+	if args.metrics_port is not None:
+		telemetry.serve(args.metrics_port)
+
+	start_time = time.time()
+
+	if args.convert:
+		roster = rally_format.load_roster(args.input)
+		rally_format.write_roster(args.convert, roster)
+		logging.info("Wrote {} cards to {}.".format(len(roster), args.convert))
+	elif args.convert_scores:
+		roster = rally_format.load_roster(args.input)
+		count = rally_format.scores_json_to_results(args.convert_scores[0], roster, args.convert_scores[1])
+		logging.info("Wrote {} ranked decks to {}.".format(count, args.convert_scores[1]))
+	elif args.results:
+		app = AppState()
+		app.processes = args.processes or 1
+		app.results_path = args.results
+		app.results_ranking = args.results_ranking
+		app.load(args.input)
+		app.maximize_resources()
+	elif args.simulate:
+		if args.strategy and len(set(map(lambda s: s[0], args.strategy))) < len(args.strategy):
+			parser.error("strategy names must be unique")
+
+		strategies = list(map(lambda s: (s[0], dict({'max_deck_size': args.max_deck_size}, **s[1])), args.strategy or [('default', {})]))
+		simulate(args.input, args.simulate, args.rounds, seed=args.seed, processes=args.processes, strategies=strategies)
+	elif args.sweep:
+		app = AppState()
+		app.processes = args.processes or 1
+		app.load(args.input)
+		app.sweep_objectives(args.formulas, args.penalties)
+	else:
+		app = AppState()
+		app.load(args.input)
+		app.run()
+
+	logging.info("Execution time: {:.3f}s".format(time.time() - start_time))
+	profile_tools.log_digest()
+	telemetry.log_metrics()
\ No newline at end of file
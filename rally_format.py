@@ -0,0 +1,281 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+# Fixed-width little-endian files: a 32 byte header followed by packed records.
+# Codes match the Element and Resource enum values in rally-optimize.py.
+ELEMENT_CODES = {'E': 1, 'F': 2, 'I': 3, 'L': 4}
+RESOURCE_CODES = {'W': 1, 'S': 2, 'C': 3}
+ELEMENT_LETTERS = {v: k for k, v in ELEMENT_CODES.items()}
+RESOURCE_LETTERS = {v: k for k, v in RESOURCE_CODES.items()}
+
+MAX_ELEMENTS = 4
+
+# results store decks as a 64-bit mask over roster indices
+MAX_ROSTER = 64
+
+ROSTER_MAGIC = b'RBROSTER'
+RESULTS_MAGIC = b'RBRESULT'
+VERSION = 1
+
+HEADER = struct.Struct('<8sHHQ')
+HEADER_SIZE = 32
+
+ROSTER_DTYPE = np.dtype([
+    ('elements', 'u1', (MAX_ELEMENTS,)),
+    ('n_elements', 'u1'),
+    ('resource', 'u1'),
+    ('amount', '<u2'),
+])
+
+# cards is a bitmask over roster indices
+RESULT_DTYPE = np.dtype([
+    ('rank', '<u4'),
+    ('size', '<u4'),
+    ('cards', '<u8'),
+    ('score', '<f8'),
+    ('wood', '<f8'),
+    ('stone', '<f8'),
+    ('damage', '<f8'),
+])
+
+def _write_header(f, magic, dtype, count):
+    f.write(HEADER.pack(magic, VERSION, dtype.itemsize, count).ljust(HEADER_SIZE, b'\0'))
+
+def _read_header(path, magic, dtype):
+    with open(path, 'rb') as f:
+        raw = f.read(HEADER_SIZE)
+
+    if len(raw) < HEADER_SIZE:
+        raise ValueError("{}: truncated header".format(path))
+
+    file_magic, version, record_size, count = HEADER.unpack_from(raw)
+
+    if file_magic != magic:
+        raise ValueError("{}: expected {} file, found magic {!r}".format(path, magic.decode(), file_magic))
+    if version != VERSION:
+        raise ValueError("{}: unsupported version {}".format(path, version))
+    if record_size != dtype.itemsize:
+        raise ValueError("{}: record size {} does not match {}".format(path, record_size, dtype.itemsize))
+
+    expected = HEADER_SIZE + count * record_size
+
+    if os.path.getsize(path) != expected:
+        raise ValueError("{}: {} records need {} bytes, file has {}".format(path, count, expected, os.path.getsize(path)))
+
+    return count
+
+def _map(path, magic, dtype):
+    count = _read_header(path, magic, dtype)
+
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+
+    return np.memmap(path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(count,))
+
+def is_roster(path):
+    with open(path, 'rb') as f:
+        return f.read(len(ROSTER_MAGIC)) == ROSTER_MAGIC
+
+def card_record(elements, resource, amount):
+    record = np.zeros((), dtype=ROSTER_DTYPE)
+    codes = sorted(elements)
+
+    if not 1 <= len(codes) <= MAX_ELEMENTS:
+        raise ValueError("cards have 1 to {} elements, got {}".format(MAX_ELEMENTS, len(codes)))
+    if not 0 <= amount <= 0xffff:
+        raise ValueError("resource amount {} out of range".format(amount))
+
+    record['elements'][:len(codes)] = codes
+    record['n_elements'] = len(codes)
+    record['resource'] = resource
+    record['amount'] = amount
+
+    return record
+
+def card_repr(record):
+    elements = "".join(map(lambda e: ELEMENT_LETTERS[e], record['elements'][:record['n_elements']]))
+
+    return "<Card-{}-{}{}>".format(elements, RESOURCE_LETTERS[int(record['resource'])], int(record['amount']))
+
+def parse_tsv(path):
+    """Parse and validate a tab-separated card list, e.g. "EFFL<tab>W3"."""
+    records = []
+
+    with open(path, 'r') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+
+            if not line:
+                continue
+
+            fields = line.split('\t')
+
+            if len(fields) != 2:
+                raise ValueError("{}:{}: expected 2 tab-separated fields, got {}".format(path, number, len(fields)))
+
+            elements, resource = fields
+
+            try:
+                codes = list(map(lambda e: ELEMENT_CODES[e], elements))
+                resource_code = RESOURCE_CODES[resource[:1]]
+                amount = int(resource[1:])
+                records.append(card_record(codes, resource_code, amount))
+            except (KeyError, ValueError) as e:
+                raise ValueError("{}:{}: invalid card {!r}: {}".format(path, number, line, e))
+
+    return np.array(records, dtype=ROSTER_DTYPE)
+
+def write_roster(path, roster):
+    roster = np.asarray(roster, dtype=ROSTER_DTYPE)
+
+    with open(path, 'wb') as f:
+        _write_header(f, ROSTER_MAGIC, ROSTER_DTYPE, len(roster))
+        f.write(roster.tobytes())
+
+def read_roster(path):
+    roster = _map(path, ROSTER_MAGIC, ROSTER_DTYPE)
+
+    if np.any(roster['n_elements'] < 1) or np.any(roster['n_elements'] > MAX_ELEMENTS):
+        raise ValueError("{}: invalid element count".format(path))
+
+    used = np.arange(MAX_ELEMENTS)[np.newaxis, :] < roster['n_elements'][:, np.newaxis]
+
+    if not np.all(np.isin(roster['elements'][used], list(ELEMENT_LETTERS))):
+        raise ValueError("{}: invalid element code".format(path))
+    if not np.all(np.isin(roster['resource'], list(RESOURCE_LETTERS))):
+        raise ValueError("{}: invalid resource code".format(path))
+
+    return roster
+
+def load_roster(path):
+    """Read a binary roster, or parse the path as a tab-separated card list."""
+    if is_roster(path):
+        return read_roster(path)
+
+    return parse_tsv(path)
+
+def read_results(path):
+    return _map(path, RESULTS_MAGIC, RESULT_DTYPE)
+
+class ResultWriter(object):
+    """Streams ranked results to disk in fixed-size chunks.
+
+    The record count in the header is patched in when the writer closes.
+    """
+
+    def __init__(self, path, chunk_size=4096):
+        self.path = path
+        self.count = 0
+        self.buffer = np.zeros(chunk_size, dtype=RESULT_DTYPE)
+        self.buffered = 0
+
+        self.f = open(path, 'wb')
+        _write_header(self.f, RESULTS_MAGIC, RESULT_DTYPE, 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def write(self, cards, score, wood, stone, damage=float('nan')):
+        if not 0 <= cards < 1 << MAX_ROSTER:
+            raise ValueError("deck mask {:#x} does not fit a {}-card roster".format(cards, MAX_ROSTER))
+
+        record = self.buffer[self.buffered]
+        record['rank'] = self.count + self.buffered + 1
+        record['size'] = bin(cards).count('1')
+        record['cards'] = cards
+        record['score'] = score
+        record['wood'] = wood
+        record['stone'] = stone
+        record['damage'] = damage
+
+        self.buffered += 1
+
+        if self.buffered == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        self.f.write(self.buffer[:self.buffered].tobytes())
+        self.count += self.buffered
+        self.buffered = 0
+
+    def close(self):
+        if self.f.closed:
+            return
+
+        self.flush()
+        self.f.seek(0)
+        _write_header(self.f, RESULTS_MAGIC, RESULT_DTYPE, self.count)
+        self.f.close()
+
+def tsv_to_roster(tsv_path, out_path):
+    roster = parse_tsv(tsv_path)
+    write_roster(out_path, roster)
+
+    return len(roster)
+
+def deck_mask(description, roster):
+    """Resolve a deck description ("Existing" or "Shatter <Card-..>, ...") to a roster bitmask."""
+    if len(roster) > MAX_ROSTER:
+        raise ValueError("results hold decks from rosters of at most {} cards, got {}".format(MAX_ROSTER, len(roster)))
+
+    mask = (1 << len(roster)) - 1
+
+    if description == "Existing":
+        return mask
+
+    if not description.startswith("Shatter "):
+        raise ValueError("unrecognized deck description {!r}".format(description))
+
+    reprs = list(map(card_repr, roster))
+
+    for missing in description[len("Shatter "):].split(", "):
+        # identical cards may appear more than once, shatter the first one still in the deck
+        for i in range(len(reprs)):
+            if reprs[i] == missing and mask & (1 << i):
+                mask &= ~(1 << i)
+                break
+        else:
+            raise ValueError("deck {!r} shatters {} which is not in the roster".format(description, missing))
+
+    return mask
+
+def scores_json_to_results(json_path, roster, out_path):
+    """Convert a scores.json dump into a ranked results file."""
+    with open(json_path, 'r') as f:
+        score_data = json.load(f)
+
+    if not isinstance(score_data, dict):
+        raise ValueError("{}: expected an object keyed by deck".format(json_path))
+
+    decks = []
+
+    for description, pairs in score_data.items():
+        wood = 0.0
+        stone = 0.0
+
+        for key, value in pairs.items():
+            if isinstance(value, str):
+                # older dumps keyed pairs by card, overwriting each other, and rounded values to 3 decimals
+                raise ValueError("{}: {} stores {!r} for {}; dumps with \"<w Wood, s Stone>\" strings are lossy and cannot be converted, regenerate scores.json".format(json_path, description, value, key))
+
+            if not isinstance(value, list) or len(value) != 2:
+                raise ValueError("{}: {} has invalid resources {!r} for {}".format(json_path, description, value, key))
+
+            wood += float(value[0])
+            stone += float(value[1])
+
+        decks.append((deck_mask(description, roster), min(wood, stone) * 2, wood, stone))
+
+    decks.sort(key=lambda d: d[1], reverse=True)
+
+    with ResultWriter(out_path) as writer:
+        for cards, score, wood, stone in decks:
+            writer.write(cards, score, wood, stone)
+
+    return len(decks)
@@ -0,0 +1,167 @@
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+# counters only ever grow, gauges hold the latest value; both are keyed by
+# (name, labels) where labels is a sorted tuple of (key, value) pairs
+counters = {}
+gauges = {}
+phase_times = {}
+cache_sources = {}
+
+start_time = time.time()
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+def _format_key(key, quote=False):
+    name, labels = key
+
+    if not labels:
+        return name
+
+    if quote:
+        fields = ",".join(map(lambda l: "{}=\"{}\"".format(l[0], l[1]), labels))
+    else:
+        fields = ",".join(map(lambda l: "{}={}".format(l[0], l[1]), labels))
+
+    return "{}{{{}}}".format(name, fields)
+
+def increment(name, amount=1, **labels):
+    key = _key(name, labels)
+    counters[key] = counters.get(key, 0) + amount
+
+def set_gauge(name, value, **labels):
+    gauges[_key(name, labels)] = value
+
+def cache_lookup(cache, hit):
+    if hit:
+        increment('cache_hits', cache=cache)
+    else:
+        increment('cache_misses', cache=cache)
+
+def register_cache(cache, info):
+    """Report the hits and misses of a functools.lru_cache by its cache_info."""
+    cache_sources[cache] = info
+
+class Phase(object):
+    def __init__(self, desc):
+        self.desc = desc
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, type, value, traceback):
+        duration = time.time() - self.start
+
+        increment('phase_seconds', duration, phase=self.desc)
+        increment('phase_calls', phase=self.desc)
+
+def snapshot():
+    values = dict(counters)
+
+    for cache, info in cache_sources.items():
+        stats = info()
+        hits = _key('cache_hits', {'cache': cache})
+        misses = _key('cache_misses', {'cache': cache})
+        values[hits] = values.get(hits, 0) + stats.hits
+        values[misses] = values.get(misses, 0) + stats.misses
+
+    return values, dict(gauges)
+
+def difference(after, before):
+    """Counter growth between two snapshots, e.g. what one worker job added."""
+    return {k: v - before.get(k, 0) for k, v in after.items() if v != before.get(k, 0)}
+
+def merge(values):
+    """Fold counters reported by another process into this one."""
+    for key, value in values.items():
+        counters[key] = counters.get(key, 0) + value
+
+def log_metrics(previous=None):
+    """Log a JSON metrics line; pass the previous return value to include per-second rates."""
+    now = time.time()
+    values, current_gauges = snapshot()
+
+    record = {
+        'uptime': round(now - start_time, 3),
+        'counters': {_format_key(k): v for k, v in sorted(values.items())},
+        'gauges': {_format_key(k): v for k, v in sorted(current_gauges.items())},
+    }
+
+    if previous is not None:
+        # divide by the time that actually passed, the reporter's sleep can drift
+        previous_time, previous_values = previous
+        elapsed = now - previous_time
+
+        if elapsed > 0:
+            record['rates'] = {_format_key(k): (v - previous_values.get(k, 0)) / elapsed for k, v in sorted(values.items())}
+
+    logging.info("metrics {}".format(json.dumps(record, sort_keys=True)))
+
+    return now, values
+
+def render_prometheus():
+    values, current_gauges = snapshot()
+    lines = []
+    seen = set()
+
+    for kind, series in (('counter', values), ('gauge', current_gauges)):
+        for key, value in sorted(series.items()):
+            name = "rally_{}".format(key[0])
+
+            if name not in seen:
+                lines.append("# TYPE {} {}".format(name, kind))
+                seen.add(name)
+
+            lines.append("rally_{} {}".format(_format_key(key, quote=True), value))
+
+    lines.append("rally_uptime_seconds {:.3f}".format(time.time() - start_time))
+
+    return "\n".join(lines) + "\n"
+
+def start_reporter(interval):
+    """Log a JSON metrics line every interval seconds from a daemon thread."""
+    def report():
+        previous = None
+
+        while True:
+            time.sleep(interval)
+            previous = log_metrics(previous)
+
+    thread = threading.Thread(target=report, name="telemetry-reporter", daemon=True)
+    thread.start()
+
+    return thread
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+
+        body = render_prometheus().encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if __debug__:
+            logging.debug(format % args)
+
+def serve(port, host='127.0.0.1'):
+    """Expose /metrics in the Prometheus text format from a daemon thread."""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+
+    thread = threading.Thread(target=server.serve_forever, name="telemetry-server", daemon=True)
+    thread.start()
+
+    logging.info("Serving metrics on http://{}:{}/metrics".format(host, server.server_port))
+
+    return server